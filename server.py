@@ -1,20 +1,671 @@
+import array
+import asyncio
+import base64
+import contextlib
+import errno
+import functools
+import io
+import mmap
+import os
 import re
-import subprocess
+import stat
+import sys
 import tempfile
+import threading
+import urllib.parse
+from collections import OrderedDict
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import Optional, List, Dict, Any
-
-from marker.converters.pdf import PdfConverter
-import io
-import contextlib
-from marker.models import create_model_dict
-from marker.output import text_from_rendered
+from typing import Optional, List, Dict, Any, TYPE_CHECKING
 
 from mcp.server.fastmcp import FastMCP
 
+try:
+    # Python 3.11+; the sre_* aliases are deprecated there
+    from re import _constants as _sre_constants, _parser as _sre_parse
+except ImportError:
+    import sre_constants as _sre_constants, sre_parse as _sre_parse
+
+if TYPE_CHECKING:
+    from marker.converters.pdf import PdfConverter
+
 mcp = FastMCP("zbigniew-mcp")
 
 
+_CONVERTER = None
+_CONVERTER_LOCK = threading.Lock()
+# Serializes conversions: stdout redirection is process-wide and the models are shared
+_CONVERT_LOCK = threading.Lock()
+
+# Line endings, as recognised by a text-mode read (universal newlines): LF, CRLF or a lone CR
+_LINE_END_RE = re.compile(rb"\r\n?|\n")
+# Character class categories (\d, \w, \S and their inverses), by whether they include a newline
+_NEWLINE_CATEGORIES = {
+    _sre_constants.CATEGORY_DIGIT: False,
+    _sre_constants.CATEGORY_NOT_DIGIT: True,
+    _sre_constants.CATEGORY_SPACE: True,
+    _sre_constants.CATEGORY_NOT_SPACE: False,
+    _sre_constants.CATEGORY_WORD: False,
+    _sre_constants.CATEGORY_NOT_WORD: True,
+}
+_COUNT_CHUNK_SIZE = 1 << 20
+# Errors from opening a path that Path.exists() would report as a missing file
+_MISSING_FILE_ERRNOS = (errno.ENOENT, errno.ENOTDIR, errno.ELOOP)
+# Files above this size are memory-mapped instead of being read (and cached) whole
+_MMAP_THRESHOLD = 1 << 20
+
+# Contents (and, once needed, line offsets) of recently read files, keyed by (path, inode, mtime, size)
+_FILE_CACHE = OrderedDict()
+_FILE_CACHE_MAX_ENTRIES = 32
+_FILE_CACHE_MAX_BYTES = 256 << 20
+_file_cache_bytes = 0
+
+# The process umask, applied to files created through _atomic_write
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@functools.lru_cache(maxsize=256)
+def _get_regex(pattern: str, flags: int) -> re.Pattern:
+    """Compile a regex pattern, reusing compiled objects across tool calls."""
+    return re.compile(pattern, flags)
+
+
+def _class_matches_newline(items: list) -> Optional[bool]:
+    """Whether a parsed character class matches a newline, or None if it uses anything unrecognised."""
+    negated = bool(items) and items[0][0] == _sre_constants.NEGATE
+    hit = False
+    for op, av in items[1:] if negated else items:
+        if op == _sre_constants.LITERAL:
+            hit = hit or av == 10
+        elif op == _sre_constants.RANGE:
+            hit = hit or av[0] <= 10 <= av[1]
+        elif op == _sre_constants.CATEGORY and av in _NEWLINE_CATEGORIES:
+            hit = hit or _NEWLINE_CATEGORIES[av]
+        else:
+            return None
+    return hit != negated
+
+
+def _stays_on_line(nodes, dotall: bool) -> bool:
+    """
+    Whether a parsed regex only ever looks at characters within one line: it never matches or
+    asserts on a newline, and uses no anchor or construct whose result depends on where the
+    searched string ends. Anything not known to be safe counts as unsafe.
+    """
+    for op, av in nodes:
+        if op == _sre_constants.LITERAL:
+            if av == 10:
+                return False
+        elif op == _sre_constants.NOT_LITERAL:
+            if av != 10:
+                return False
+        elif op == _sre_constants.ANY:
+            if dotall:
+                return False
+        elif op == _sre_constants.IN:
+            if _class_matches_newline(av) is not False:
+                return False
+        elif op == _sre_constants.AT:
+            # ^ and \b behave the same at a line's edges as at the string's; $, \A, \Z and \B don't
+            if av not in (_sre_constants.AT_BEGINNING, _sre_constants.AT_BOUNDARY):
+                return False
+        elif op in (_sre_constants.MAX_REPEAT, _sre_constants.MIN_REPEAT):
+            if not _stays_on_line(av[2], dotall):
+                return False
+        elif op == _sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            sub_dotall = (dotall or bool(add_flags & re.DOTALL)) and not del_flags & re.DOTALL
+            if not _stays_on_line(sub, sub_dotall):
+                return False
+        elif op == _sre_constants.BRANCH:
+            if not all(_stays_on_line(branch, dotall) for branch in av[1]):
+                return False
+        elif op == _sre_constants.ASSERT:
+            # Positive lookarounds only reach past the line by matching its newline
+            if not _stays_on_line(av[1], dotall):
+                return False
+        elif op != _sre_constants.GROUPREF:
+            # Negative lookarounds, atomic groups, possessive repeats, conditionals, ...
+            return False
+    return True
+
+
+@functools.lru_cache(maxsize=256)
+def _get_text_regex(pattern: str, flags: int) -> Optional[re.Pattern]:
+    """
+    Compile the MULTILINE variant of a pattern used to find candidate lines across a whole text,
+    or return None if the pattern could match differently there than on a single line.
+    A pattern that can run past a newline would also make each search scan the rest of the text.
+    """
+    try:
+        parsed = _sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    if not _stays_on_line(parsed, bool(parsed.state.flags & re.DOTALL)):
+        return None
+    return re.compile(pattern, flags | re.MULTILINE)
+
+
+def _iter_chunks(buf, start: int, end: int):
+    """Yield consecutive slices of buf[start:end] (bytes or mmap) of about _COUNT_CHUNK_SIZE bytes, never splitting a CRLF."""
+    # mmap.count() only exists on Python 3.13+, so callers work through fixed-size chunks
+    pos = start
+    while pos < end:
+        stop = min(pos + _COUNT_CHUNK_SIZE, end)
+        while stop < end and buf[stop - 1:stop] == b'\r':
+            stop += 1
+        yield buf[pos:stop]
+        pos = stop
+
+
+def _count_line_ends(chunk: bytes) -> int:
+    """Count the line endings (LF, CRLF or a lone CR) in chunk."""
+    count = chunk.count(b'\n')
+    if b'\r' in chunk:
+        count += chunk.count(b'\r') - chunk.count(b'\r\n')
+    return count
+
+
+def _decode_text(data, errors: str = "replace") -> str:
+    """Decode file bytes as UTF-8 with universal newlines, like a text-mode read."""
+    text = data.decode("utf-8", errors=errors)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def _split_lines(text: str) -> List[str]:
+    """Split text decoded by _decode_text into lines, without an empty line after a trailing newline."""
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def _iter_line_chunks(mm: mmap.mmap):
+    """Yield consecutive slices of mm of about _COUNT_CHUNK_SIZE bytes, each ending on a line boundary."""
+    size = len(mm)
+    pos = 0
+    while pos < size:
+        end = mm.find(b'\n', min(pos + _COUNT_CHUNK_SIZE, size) - 1)
+        end = size if end == -1 else end + 1
+        yield mm[pos:end]
+        pos = end
+
+
+def _search_lines(line_regex: re.Pattern, lines, line_number: int, matches: List[dict], max_matches: int) -> bool:
+    """
+    Append the lines from an iterable of newline-terminated lines that match line_regex to matches,
+    numbering them from line_number. Returns True once max_matches is reached.
+    """
+    search_line = line_regex.search
+    for line_number, line in enumerate(lines, line_number):
+        if search_line(line):
+            matches.append({
+                "line_number": line_number,
+                "content": line.rstrip('\n')
+            })
+            if max_matches > 0 and len(matches) >= max_matches:
+                return True
+    return False
+
+
+def _search_text(
+        line_regex: re.Pattern,
+        text_regex: Optional[re.Pattern],
+        text: str,
+        line_number: int,
+        matches: List[dict],
+        max_matches: int
+) -> bool:
+    """
+    Append the lines of text that match line_regex to matches, numbering them from line_number.
+    Returns True once max_matches is reached.
+
+    text_regex (see _get_text_regex) jumps straight to candidate lines across the whole text; each
+    candidate is then confirmed by running line_regex on that line alone. Without text_regex, or
+    once candidates turn out to be dense, every line is checked in turn instead.
+    """
+    if text_regex is None:
+        return _search_lines(line_regex, io.StringIO(text), line_number, matches, max_matches)
+
+    search_line = line_regex.search
+    first_line = line_number
+    candidates = 0
+    size = len(text)
+    pos = 0  # offset at which the next unexamined line starts
+    cursor = 0  # offset at which line `line_number` starts
+    while pos < size:
+        m = text_regex.search(text, pos)
+        if m is None:
+            break
+        newline = text.rfind('\n', pos, m.start())
+        line_start = pos if newline == -1 else newline + 1
+        # A match at the end after a trailing newline does not belong to any line
+        if line_start >= size:
+            break
+
+        line_end = text.find('\n', line_start)
+        pos = size if line_end == -1 else line_end + 1
+        line_number += text.count('\n', cursor, line_start)
+        cursor = line_start
+        line = text[line_start:pos]
+        if search_line(line):
+            matches.append({
+                "line_number": line_number,
+                "content": line.rstrip('\n')
+            })
+            if max_matches > 0 and len(matches) >= max_matches:
+                return True
+
+        # Jumping between candidates costs more per line than a plain scan once they are this common
+        candidates += 1
+        if candidates >= 64 and candidates * 4 > line_number - first_line + 1:
+            return _search_lines(line_regex, io.StringIO(text[pos:]), line_number + 1, matches, max_matches)
+    return False
+
+
+def _cache_entry_size(entry: list) -> int:
+    """Bytes held by a file cache entry: the contents plus the line offsets, if built."""
+    data, line_starts = entry
+    return len(data) + (0 if line_starts is None else line_starts.itemsize * len(line_starts))
+
+
+def _read_all(fd: int, size: int = 0) -> bytes:
+    """Read an open file to EOF, asking for size bytes (its expected length, if known) first."""
+    # A single os.read may return less than asked for, and pseudo-files report a size of 0
+    chunks = []
+    while True:
+        chunk = os.read(fd, size if size > 0 and not chunks else _COUNT_CHUNK_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _line_starts(data: bytes) -> array.array:
+    """Return the offsets at which the lines of data start."""
+    line_starts = array.array('Q', [0])
+    line_starts.extend(m.end() for m in _LINE_END_RE.finditer(data))
+    return line_starts
+
+
+def _read_cached(
+        file_path: Path,
+        fd: int,
+        st: os.stat_result,
+        with_line_starts: bool = False
+) -> tuple[bytes, Optional[array.array]]:
+    """
+    Return the contents of an open file and, if requested, the offsets at which its lines start.
+    Results are cached until the file's inode, mtime or size changes; line offsets are only
+    built the first time a caller asks for them.
+    """
+    global _file_cache_bytes
+    key = (os.path.abspath(file_path), st.st_ino, st.st_mtime_ns, st.st_size)
+    entry = _FILE_CACHE.get(key)
+    if entry is not None:
+        _FILE_CACHE.move_to_end(key)
+    else:
+        entry = [_read_all(fd, st.st_size), None]
+        _FILE_CACHE[key] = entry
+        _file_cache_bytes += _cache_entry_size(entry)
+
+    if with_line_starts and entry[1] is None:
+        line_starts = _line_starts(entry[0])
+        entry[1] = line_starts
+        _file_cache_bytes += line_starts.itemsize * len(line_starts)
+
+    while len(_FILE_CACHE) > _FILE_CACHE_MAX_ENTRIES or _file_cache_bytes > _FILE_CACHE_MAX_BYTES:
+        _, old_entry = _FILE_CACHE.popitem(last=False)
+        _file_cache_bytes -= _cache_entry_size(old_entry)
+    return entry[0], entry[1]
+
+
+def _count_mapped_lines(mm: mmap.mmap) -> int:
+    """Count lines in a memory-mapped file."""
+    count = sum(_count_line_ends(chunk) for chunk in _iter_chunks(mm, 0, len(mm)))
+    # A final line without a line ending still counts as a line
+    return count + (0 if mm[-1:] in (b'\n', b'\r') else 1)
+
+
+def _skip_lines(buf, pos: int, count: int) -> int:
+    """Return the offset just past the count-th line ending at or after pos, or len(buf) if there are fewer."""
+    if not count:
+        return pos
+    for chunk in _iter_chunks(buf, pos, len(buf)):
+        line_ends = _count_line_ends(chunk)
+        if line_ends < count:
+            # Skip whole chunks without visiting their lines one by one
+            count -= line_ends
+            pos += len(chunk)
+            continue
+        if b'\r' not in chunk:
+            idx = -1
+            for _ in range(count):
+                idx = chunk.find(b'\n', idx + 1)
+            return pos + idx + 1
+        for m in _LINE_END_RE.finditer(chunk):
+            count -= 1
+            if not count:
+                return pos + m.end()
+    return len(buf)
+
+
+def _decode_lines(buf, start: int, end: int) -> str:
+    """Decode the lines in buf[start:end], which ends where the line after them starts, joined with LF."""
+    text = _decode_text(buf[start:end])
+    return text[:-1] if text.endswith('\n') else text
+
+
+def _get_converter() -> "PdfConverter":
+    """Return the shared PdfConverter, importing Marker and loading its models on first use."""
+    global _CONVERTER
+    if _CONVERTER is None:
+        with _CONVERTER_LOCK:
+            if _CONVERTER is None:
+                # Marker pulls in torch and transformers, so only import it when a PDF needs converting
+                from marker.converters.pdf import PdfConverter
+                from marker.models import create_model_dict
+
+                _CONVERTER = PdfConverter(artifact_dict=create_model_dict())
+    return _CONVERTER
+
+
+@contextlib.contextmanager
+def _discard_output():
+    """Send Python-level stdout/stderr and C-level stderr writes to the null device."""
+    # fd 1 is left alone: the stdio transport writes protocol messages to it from the event loop
+    sys.stderr.flush()
+    with open(os.devnull, "w") as devnull:
+        saved_stderr_fd = os.dup(2)
+        try:
+            os.dup2(devnull.fileno(), 2)
+            with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                yield
+        finally:
+            os.dup2(saved_stderr_fd, 2)
+            os.close(saved_stderr_fd)
+
+
+def _pdf_to_text(pdf_path: str) -> str:
+    """Extract text from a PDF with the shared converter, suppressing Marker's output."""
+    from marker.output import text_from_rendered
+
+    with _CONVERT_LOCK, _discard_output():
+        rendered = _get_converter()(pdf_path)
+        text, _, images = text_from_rendered(rendered)
+    return text
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collect the visible text of an HTML document, starting a new line at block elements."""
+
+    _SKIP_TAGS = {"head", "script", "style", "noscript", "template", "svg"}
+    _BLOCK_TAGS = {
+        "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption",
+        "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav",
+        "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul"
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self._BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self._BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def text(self) -> str:
+        # Collapse whitespace within lines and drop the empty ones
+        lines = (" ".join(line.split()) for line in "".join(self._parts).splitlines())
+        return "\n".join(line for line in lines if line)
+
+
+def _html_to_text(html: str) -> str:
+    """Extract readable text from an HTML document."""
+    parser = _HTMLTextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+async def _kill_if_running(proc: asyncio.subprocess.Process) -> None:
+    """Kill and reap a subprocess that has not exited yet."""
+    if proc.returncode is None:
+        with contextlib.suppress(ProcessLookupError):
+            proc.kill()
+        await proc.wait()
+
+
+async def _run_chromium(*args: str) -> tuple[int, bytes, bytes]:
+    """Run headless Chromium with the given arguments and return (exit code, stdout, stderr)."""
+    proc = await asyncio.create_subprocess_exec(
+        "chromium",
+        "--headless",
+        "--disable-gpu",
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await proc.communicate()
+    finally:
+        # Don't leave Chromium running if the tool call is cancelled
+        await _kill_if_running(proc)
+    return proc.returncode, stdout, stderr
+
+
+async def _fetch_page_text(url: str, chromium_slots=None) -> tuple[str, Optional[str]]:
+    """
+    Fetch the text of a web page, returning (text, error).
+    Reads the rendered DOM directly and only falls back to PDF + Marker for PDFs or pages without extractable text.
+    """
+    # Bounds concurrent Chromium processes when fetching in a batch
+    chromium_slots = chromium_slots or contextlib.nullcontext()
+
+    if not urllib.parse.urlsplit(url).path.lower().endswith(".pdf"):
+        async with chromium_slots:
+            returncode, stdout, stderr = await _run_chromium("--dump-dom", url)
+        if returncode != 0:
+            return "", f"Error fetching page: {stderr.decode('utf-8', errors='replace')}"
+
+        text = _html_to_text(stdout.decode("utf-8", errors="replace"))
+        if text:
+            return text, None
+
+    # Create a temporary file and immediately close it so Chromium can write to it.
+    tmp_fd, temp_pdf_path = tempfile.mkstemp(prefix="page", suffix=".pdf")
+    os.close(tmp_fd)
+
+    try:
+        async with chromium_slots:
+            returncode, _, stderr = await _run_chromium(f"--print-to-pdf={temp_pdf_path}", url)
+        if returncode != 0:
+            return "", f"Error fetching page: {stderr.decode('utf-8', errors='replace')}"
+
+        # Run the blocking conversion in a worker thread so the event loop stays responsive
+        text = await asyncio.get_running_loop().run_in_executor(None, _pdf_to_text, temp_pdf_path)
+        return text, None
+
+    finally:
+        try:
+            os.unlink(temp_pdf_path)
+        except FileNotFoundError:
+            pass
+
+
+def _do_insert(lines: List[str], op: Dict[str, Any], line_ops_performed: List[dict]) -> None:
+    """Insert one or more lines before the given line number."""
+    line_num = op.get("line", 0)
+    new_content = op.get("content", "")
+
+    # Convert to 0-based index
+    idx = min(max(0, line_num - 1), len(lines))
+
+    # Insert the new content with a single slice assignment
+    lines[idx:idx] = new_content if isinstance(new_content, list) else [new_content]
+
+    line_ops_performed.append({
+        "operation": "insert",
+        "line": line_num,
+        "success": True
+    })
+
+
+def _do_replace(lines: List[str], op: Dict[str, Any], line_ops_performed: List[dict]) -> None:
+    """Replace the content of a single line."""
+    line_num = op.get("line", 0)
+    new_content = op.get("content", "")
+
+    # Convert to 0-based index
+    idx = line_num - 1
+
+    # Validate line number
+    if 0 <= idx < len(lines):
+        old_line = lines[idx]
+        lines[idx] = new_content
+
+        line_ops_performed.append({
+            "operation": "replace",
+            "line": line_num,
+            "success": True,
+            "old_content": old_line
+        })
+    else:
+        line_ops_performed.append({
+            "operation": "replace",
+            "line": line_num,
+            "success": False,
+            "error": f"Line {line_num} is out of range (1-{len(lines)})"
+        })
+
+
+def _do_delete(lines: List[str], op: Dict[str, Any], line_ops_performed: List[dict]) -> None:
+    """Delete an inclusive range of lines."""
+    start_line = op.get("start_line", 0)
+    end_line = op.get("end_line", start_line)
+
+    # Convert to 0-based indices
+    start_idx = max(0, start_line - 1)
+    end_idx = min(len(lines), end_line)
+
+    # Validate line range
+    if start_idx < end_idx:
+        deleted_lines = lines[start_idx:end_idx]
+        lines[start_idx:end_idx] = []
+
+        line_ops_performed.append({
+            "operation": "delete",
+            "start_line": start_line,
+            "end_line": end_line,
+            "lines_deleted": end_idx - start_idx,
+            "success": True,
+            "deleted_content": deleted_lines
+        })
+    else:
+        line_ops_performed.append({
+            "operation": "delete",
+            "start_line": start_line,
+            "end_line": end_line,
+            "success": False,
+            "error": f"Invalid line range: {start_line}-{end_line}"
+        })
+
+
+# Line operation handlers for edit_file, keyed by lowercase operation name
+_OP_HANDLERS = {
+    "insert": _do_insert,
+    "replace": _do_replace,
+    "delete": _do_delete,
+}
+
+
+async def _read_capped(stream: asyncio.StreamReader, max_bytes: Optional[int]) -> tuple[bytes, bool]:
+    """
+    Read a subprocess pipe to EOF, keeping only its first max_bytes bytes (all of it if max_bytes
+    is None or negative). Returns the kept bytes and whether anything was dropped.
+    """
+    if max_bytes is None or max_bytes < 0:
+        return await stream.read(), False
+    chunks = []
+    kept = 0
+    truncated = False
+    # Keep draining past the cap so the process never blocks on a full pipe
+    while True:
+        chunk = await stream.read(1 << 16)
+        if not chunk:
+            return b"".join(chunks), truncated
+        if len(chunk) > max_bytes - kept:
+            truncated = True
+            chunk = chunk[:max_bytes - kept]
+        if chunk:
+            chunks.append(chunk)
+            kept += len(chunk)
+
+
+async def _communicate_capped(
+        proc: asyncio.subprocess.Process,
+        max_bytes: Optional[int]
+) -> tuple[tuple[bytes, bool], tuple[bytes, bool]]:
+    """Like proc.communicate(), but keeping at most max_bytes of each stream (see _read_capped)."""
+    stdout, stderr, _ = await asyncio.gather(
+        _read_capped(proc.stdout, max_bytes),
+        _read_capped(proc.stderr, max_bytes),
+        proc.wait()
+    )
+    return stdout, stderr
+
+
+def _decode_output(data: bytes, binary: bool) -> str:
+    """Decode command output as UTF-8 (or base64 if binary)."""
+    if binary:
+        return base64.b64encode(data).decode("ascii")
+    return data.decode("utf-8", errors="replace")
+
+
+def _atomic_write(file_path: Path, content: str) -> None:
+    """Write content to a temporary sibling file and atomically move it over file_path."""
+    # Resolve symlinks so the link's target is replaced rather than the link itself
+    target = os.path.realpath(file_path)
+    directory, name = os.path.split(target)
+    # A unique temporary file can't clobber an unrelated file or collide with a concurrent write
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with open(tmp_fd, 'wb', buffering=1 << 20) as f:
+            f.write(content.encode('utf-8'))
+            # Get the data onto disk before the rename, so an OS crash can't leave an empty file behind
+            f.flush()
+            os.fsync(f.fileno())
+        # Keep the permissions of the file being replaced (e.g. executable scripts); mkstemp
+        # creates files as 0600, so new files get the mode a plain open() would have given them
+        try:
+            mode = os.stat(target).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
 @mcp.tool(
     description="""
     Execute a shell command and return the complete results including stdout, stderr, and exit code.
@@ -29,46 +680,64 @@ mcp = FastMCP("zbigniew-mcp")
     - Get system info: execute_shell_command(["uname", "-a"])
 
     The command will timeout after the specified seconds (default: 60) to prevent hanging.
+
+    Set max_output_bytes to cap how much of stdout and stderr is returned, and binary=True to
+    receive both streams base64-encoded instead of decoded as UTF-8 text.
     """,
 )
-def execute_shell_command(
+async def execute_shell_command(
         command: list[str],
         timeout: int = 60,
-        working_dir: str = None
+        working_dir: str = None,
+        binary: bool = False,
+        max_output_bytes: Optional[int] = None
 ) -> dict:
     """Execute a shell command and return comprehensive results."""
+    command_str = " ".join(command)
     try:
-        result = subprocess.run(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=timeout,
-            cwd=working_dir,
-            text=True
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=working_dir
         )
+        try:
+            (stdout, stdout_truncated), (stderr, stderr_truncated) = await asyncio.wait_for(
+                _communicate_capped(proc, max_output_bytes),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            return {
+                "stdout": "",
+                "stderr": f"Command timed out after {timeout} seconds",
+                "exit_code": -1,
+                "command": command_str,
+                "success": False,
+                "truncated": False
+            }
+        finally:
+            # Covers both the timeout and the client cancelling the call
+            await _kill_if_running(proc)
+
+        stdout = _decode_output(stdout, binary)
+        stderr = _decode_output(stderr, binary)
 
         return {
-            "stdout": result.stdout,
-            "stderr": result.stderr,
-            "exit_code": result.returncode,
-            "command": " ".join(command),
-            "success": result.returncode == 0
-        }
-    except subprocess.TimeoutExpired:
-        return {
-            "stdout": "",
-            "stderr": f"Command timed out after {timeout} seconds",
-            "exit_code": -1,
-            "command": " ".join(command),
-            "success": False
+            "stdout": stdout,
+            "stderr": stderr,
+            "exit_code": proc.returncode,
+            "command": command_str,
+            "success": proc.returncode == 0,
+            "truncated": stdout_truncated or stderr_truncated
         }
     except Exception as e:
         return {
             "stdout": "",
             "stderr": f"Error executing command: {str(e)}",
             "exit_code": -1,
-            "command": " ".join(command),
-            "success": False
+            "command": command_str,
+            "success": False,
+            "truncated": False
         }
 
 
@@ -97,22 +766,41 @@ def show_file(
         num_lines: Optional[int] = None
 ) -> dict:
     """Display content of a file with optional line range specification."""
-    if not file_path.exists():
+    # Open directly rather than checking existence first: one syscall instead of two
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError as e:
         return {
             "success": False,
-            "error": f"File {file_path} does not exist",
+            "error": (
+                f"File {file_path} does not exist" if e.errno in _MISSING_FILE_ERRNOS
+                else f"Error reading file: {str(e)}"
+            ),
             "content": "",
             "lines_shown": 0,
             "total_lines": 0
         }
 
+    mm = None
     try:
         # Ensure start_line is at least 1 (1-based indexing)
         start_line = max(1, start_line)
 
-        # Read all lines from the file
-        all_lines = file_path.read_text().splitlines()
-        total_lines = len(all_lines)
+        st = os.fstat(fd)
+        if stat.S_ISREG(st.st_mode) and st.st_size > _MMAP_THRESHOLD:
+            # Large file: count lines over a memory map, without loading the file into memory
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            total_lines = _count_mapped_lines(mm)
+        else:
+            if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+                # Small file: read it whole (or reuse a cached read) along with its line offsets
+                data, line_starts = _read_cached(file_path, fd, st, with_line_starts=True)
+            else:
+                # No usable size (pseudo-files under /proc, pipes, ...): read to EOF without caching
+                data = _read_all(fd)
+                line_starts = _line_starts(data)
+            # A trailing newline does not start another line
+            total_lines = len(line_starts) - (1 if line_starts[-1] == len(data) else 0)
 
         # Adjust start_line if it's beyond file length
         if start_line > total_lines:
@@ -131,19 +819,31 @@ def show_file(
         if num_lines is None:
             end_idx = total_lines
         else:
-            end_idx = min(start_idx + num_lines, total_lines)
-
-        # Extract the requested lines
-        selected_lines = all_lines[start_idx:end_idx]
-        content = "\n".join(selected_lines)
+            # A negative count shows nothing rather than indexing from the end
+            end_idx = min(start_idx + max(0, num_lines), total_lines)
+
+        # Locate the requested lines by their byte offsets and decode only that slice
+        if mm is not None:
+            buf = mm
+            start_char = _skip_lines(mm, 0, start_idx)
+            if end_idx >= total_lines:
+                end_char = len(mm)
+            else:
+                end_char = _skip_lines(mm, start_char, end_idx - start_idx)
+        else:
+            buf = data
+            start_char = line_starts[start_idx]
+            end_char = line_starts[end_idx] if end_idx < len(line_starts) else len(data)
+        content = _decode_lines(buf, start_char, end_char)
+        lines_shown = end_idx - start_idx
 
         return {
             "success": True,
             "content": content,
-            "lines_shown": len(selected_lines),
+            "lines_shown": lines_shown,
             "total_lines": total_lines,
             "start_line": start_line,
-            "end_line": start_idx + len(selected_lines)
+            "end_line": start_idx + lines_shown
         }
     except Exception as e:
         return {
@@ -153,6 +853,10 @@ def show_file(
             "lines_shown": 0,
             "total_lines": 0
         }
+    finally:
+        if mm is not None:
+            mm.close()
+        os.close(fd)
 
 
 @mcp.tool(
@@ -181,30 +885,46 @@ def search_in_file(
         max_matches: int = 100
 ) -> dict:
     """Search for regex patterns in a file and return matching lines with line numbers."""
-    if not file_path.exists():
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError as e:
         return {
             "success": False,
-            "error": f"File {file_path} does not exist",
+            "error": (
+                f"File {file_path} does not exist" if e.errno in _MISSING_FILE_ERRNOS
+                else f"Error searching file: {str(e)}"
+            ),
             "matches": [],
             "match_count": 0
         }
 
+    mm = None
     try:
-        # Compile the regex pattern
+        # Compile the regex pattern, plus a MULTILINE variant for finding candidate lines quickly
         flags = 0 if case_sensitive else re.IGNORECASE
-        regex = re.compile(pattern, flags)
+        line_regex = _get_regex(pattern, flags)
+        text_regex = _get_text_regex(pattern, flags)
 
-        # Read the file and search for matches
         matches = []
-        with open(file_path, 'r') as f:
-            for i, line in enumerate(f, 1):
-                if regex.search(line):
-                    matches.append({
-                        "line_number": i,
-                        "content": line.rstrip('\n')
-                    })
-                    if max_matches > 0 and len(matches) >= max_matches:
-                        break
+        st = os.fstat(fd)
+        sized = stat.S_ISREG(st.st_mode) and st.st_size > 0
+        if not sized or (st.st_size > _MMAP_THRESHOLD and text_regex is None):
+            # Large files checked line by line, and files without a usable size (pseudo-files
+            # under /proc, pipes, ...), are streamed like a text-mode read
+            with open(fd, encoding="utf-8", errors="replace", closefd=False) as f:
+                _search_lines(line_regex, f, 1, matches, max_matches)
+        elif st.st_size > _MMAP_THRESHOLD:
+            # Large file: decode and search the memory map one line-aligned chunk at a time
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            line_number = 1
+            for chunk in _iter_line_chunks(mm):
+                text = _decode_text(chunk)
+                if _search_text(line_regex, text_regex, text, line_number, matches, max_matches):
+                    break
+                line_number += text.count('\n')
+        else:
+            data, _ = _read_cached(file_path, fd, st)
+            _search_text(line_regex, text_regex, _decode_text(data), 1, matches, max_matches)
 
         return {
             "success": True,
@@ -226,6 +946,10 @@ def search_in_file(
             "matches": [],
             "match_count": 0
         }
+    finally:
+        if mm is not None:
+            mm.close()
+        os.close(fd)
 
 
 @mcp.tool(
@@ -268,7 +992,7 @@ def edit_file(
 
     try:
         # Read the original file content
-        original_content = file_path.read_text()
+        original_content = _decode_text(file_path.read_bytes(), errors="strict")
         content = original_content
 
         # Track changes made
@@ -278,103 +1002,42 @@ def edit_file(
         # Perform string replacements if specified
         if replacements:
             for old, new in replacements.items():
-                count = content.count(old)
+                # An empty search string has no meaningful occurrences (and cannot be split on)
+                if not old:
+                    continue
+                # split() finds every occurrence in one pass, giving both the count and the pieces to join
+                parts = content.split(old)
+                count = len(parts) - 1
                 if count > 0:
-                    content = content.replace(old, new)
+                    content = new.join(parts)
                     replacement_counts[old] = count
 
         # Perform line operations if specified
         if line_operations:
             # Convert content to lines for line-based operations
-            lines = content.splitlines()
+            lines = _split_lines(content)
             original_line_count = len(lines)
 
             # Sort operations by line number (descending) to avoid index shifting
             # This ensures operations at higher line numbers are processed first
-            sorted_ops = sorted(
-                line_operations,
-                key=lambda op: -(op.get("line", 0) if "line" in op else op.get("start_line", 0))
-            )
+            # Keys are extracted once up front; the index keeps ties in their original order
+            keyed_ops = [
+                (-(op["line"] if "line" in op else op.get("start_line", 0)), i, op)
+                for i, op in enumerate(line_operations)
+            ]
+            keyed_ops.sort()
+            sorted_ops = [op for _, _, op in keyed_ops]
 
             for op in sorted_ops:
-                operation_type = op.get("operation", "").lower()
-
-                if operation_type == "insert":
-                    line_num = op.get("line", 0)
-                    new_content = op.get("content", "")
-
-                    # Convert to 0-based index
-                    idx = min(max(0, line_num - 1), len(lines))
-
-                    # Insert the new content
-                    if isinstance(new_content, list):
-                        for i, line in enumerate(new_content):
-                            lines.insert(idx + i, line)
-                    else:
-                        lines.insert(idx, new_content)
-
-                    line_ops_performed.append({
-                        "operation": "insert",
-                        "line": line_num,
-                        "success": True
-                    })
-
-                elif operation_type == "replace":
-                    line_num = op.get("line", 0)
-                    new_content = op.get("content", "")
-
-                    # Convert to 0-based index
-                    idx = line_num - 1
-
-                    # Validate line number
-                    if 0 <= idx < len(lines):
-                        old_line = lines[idx]
-                        lines[idx] = new_content
-
-                        line_ops_performed.append({
-                            "operation": "replace",
-                            "line": line_num,
-                            "success": True,
-                            "old_content": old_line
-                        })
-                    else:
-                        line_ops_performed.append({
-                            "operation": "replace",
-                            "line": line_num,
-                            "success": False,
-                            "error": f"Line {line_num} is out of range (1-{len(lines)})"
-                        })
-
-                elif operation_type == "delete":
-                    start_line = op.get("start_line", 0)
-                    end_line = op.get("end_line", start_line)
-
-                    # Convert to 0-based indices
-                    start_idx = max(0, start_line - 1)
-                    end_idx = min(len(lines), end_line)
-
-                    # Validate line range
-                    if start_idx < end_idx:
-                        deleted_lines = lines[start_idx:end_idx]
-                        lines[start_idx:end_idx] = []
-
-                        line_ops_performed.append({
-                            "operation": "delete",
-                            "start_line": start_line,
-                            "end_line": end_line,
-                            "lines_deleted": end_idx - start_idx,
-                            "success": True,
-                            "deleted_content": deleted_lines
-                        })
-                    else:
-                        line_ops_performed.append({
-                            "operation": "delete",
-                            "start_line": start_line,
-                            "end_line": end_line,
-                            "success": False,
-                            "error": f"Invalid line range: {start_line}-{end_line}"
-                        })
-
+                operation_type = op.get("operation", "")
+                handler = _OP_HANDLERS.get(operation_type)
+                if handler is None:
+                    # Operation names are matched case-insensitively; only lowercase on a miss
+                    operation_type = operation_type.lower()
+                    handler = _OP_HANDLERS.get(operation_type)
+
+                if handler is not None:
+                    handler(lines, op, line_ops_performed)
                 else:
                     line_ops_performed.append({
                         "operation": operation_type,
@@ -382,18 +1045,23 @@ def edit_file(
                         "error": f"Unknown operation type: {operation_type}"
                     })
 
-            # Convert lines back to content
-            content = "\n".join(lines)
+            # Convert lines back to content, unless every operation failed and lines is untouched.
+            # _split_lines drops the final newline, so restore it if the file had one
+            if any(op["success"] for op in line_ops_performed):
+                content = "\n".join(lines) + ("\n" if lines and content.endswith("\n") else "")
+
+        # Identity short-circuits the comparison when nothing was applied
+        changed = content is not original_content and content != original_content
 
         # Write the modified content back to the file
-        with open(file_path, "w") as f:
-            f.write(content)
+        if changed:
+            _atomic_write(file_path, content)
 
         return {
             "success": True,
             "original_size": len(original_content),
             "new_size": len(content),
-            "changed": original_content != content,
+            "changed": changed,
             "replacements_made": replacement_counts,
             "line_operations_performed": line_ops_performed
         }
@@ -426,8 +1094,11 @@ def edit_file(
 def write_file(file_path: Path, content: str, mode: str = "w") -> dict:
     """Write content to a file."""
     try:
-        with open(file_path, mode) as f:
-            f.write(content)
+        if mode == "w":
+            _atomic_write(file_path, content)
+        else:
+            with open(file_path, mode, encoding="utf-8") as f:
+                f.write(content)
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -435,9 +1106,10 @@ def write_file(file_path: Path, content: str, mode: str = "w") -> dict:
 
 @mcp.tool(
     description="""
-    Fetch a web page by converting it to PDF and then extracting text.
+    Fetch a web page and extract its text content.
     
-    This tool fetches a web page by converting it to PDF using Chromium and then extracts the text content.
+    This tool renders the web page with headless Chromium and extracts the text from the resulting DOM.
+    PDF documents and pages without extractable text are converted to PDF and parsed with Marker instead.
     
     Parameters:
     - url: URL of the web page to fetch
@@ -445,43 +1117,41 @@ def write_file(file_path: Path, content: str, mode: str = "w") -> dict:
     Returns the extracted text content of the web page.
     """
 )
-def fetch_page(url: str) -> str:
+async def fetch_page(url: str) -> str:
     """
-    Fetch a web page by converting it to PDF and then extracting text.
-    Utilizes a temporary file and suppresses any stdout produced by the PDF converter.
+    Fetch a web page and extract its text from the rendered DOM.
+    Falls back to converting the page to PDF and extracting text with Marker.
     """
-    # Create a named temporary file and immediately close it so Chromium can write to it.
-    with tempfile.NamedTemporaryFile(prefix="page", suffix=".pdf", delete=False) as tmp_pdf:
-        temp_pdf_path = tmp_pdf.name
+    text, error = await _fetch_page_text(url)
+    return error if error is not None else text
 
-    try:
-        # Build the command for Chromium to convert the page to PDF.
-        command = [
-            "chromium",
-            "--headless",
-            "--disable-gpu",
-            f"--print-to-pdf={temp_pdf_path}",
-            url
-        ]
-        result = subprocess.run(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
 
-        if result.returncode != 0:
-            return f"Error fetching page: {result.stderr}"
-
-        with io.StringIO() as buf, contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
-            converter = PdfConverter(artifact_dict=create_model_dict())
-            rendered = converter(temp_pdf_path)
-            text, _, images = text_from_rendered(rendered)
-        return text
+@mcp.tool(
+    description="""
+    Fetch several web pages concurrently and extract their text content.
+    
+    This tool renders up to max_concurrent pages with Chromium at a time, extracting text the same way as
+    fetch_page, while the remaining pages are still being fetched.
+    
+    Parameters:
+    - urls: URLs of the web pages to fetch
+    - max_concurrent: Maximum number of pages rendered at the same time (default: 4)
+    
+    Examples:
+    - Fetch two pages: fetch_pages(["https://example.com", "https://example.org"])
+    
+    Returns a list with the url, extracted text and error (None on success) for each page, in input order.
+    """
+)
+async def fetch_pages(urls: list[str], max_concurrent: int = 4) -> list[dict]:
+    """Fetch multiple web pages concurrently and extract their text."""
+    semaphore = asyncio.Semaphore(max(1, max_concurrent))
 
-    finally:
+    async def _one(url: str) -> dict:
         try:
-            Path(temp_pdf_path).unlink()
-        except Exception:
-            pass
+            text, error = await _fetch_page_text(url, semaphore)
+            return {"url": url, "text": text, "error": error}
+        except Exception as e:
+            return {"url": url, "text": "", "error": f"Error fetching page: {str(e)}"}
 
+    return list(await asyncio.gather(*(_one(url) for url in urls)))
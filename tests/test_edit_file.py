@@ -0,0 +1,21 @@
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("original, operations, expected", [
+    ("a\nb\n", [{"operation": "replace", "line": 2, "content": "B"}], "a\nB\n"),
+    ("a\nb", [{"operation": "replace", "line": 2, "content": "B"}], "a\nB"),
+    ("a\nb\n", [{"operation": "insert", "line": 3, "content": "c"}], "a\nb\nc\n"),
+    ("a\n", [{"operation": "delete", "start_line": 1, "end_line": 1}], ""),
+    ("a\nb\n", [{"operation": "delete", "start_line": 5, "end_line": 6}], "a\nb\n"),
+])
+def test_line_operations_keep_the_final_newline(tmp_path, original, operations, expected):
+    path = tmp_path / "file.txt"
+    path.write_text(original)
+
+    result = server.edit_file(path, line_operations=operations)
+
+    assert result["success"]
+    assert path.read_text() == expected
+    assert result["changed"] == (original != expected)
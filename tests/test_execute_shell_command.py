@@ -0,0 +1,28 @@
+import asyncio
+import sys
+
+import server
+
+
+def run(command, **kwargs):
+    return asyncio.run(server.execute_shell_command(command, **kwargs))
+
+
+def test_output_is_capped_while_reading():
+    script = "import sys; sys.stdout.write('x' * 5_000_000); sys.stderr.write('ab')"
+
+    result = run([sys.executable, "-c", script], max_output_bytes=3)
+
+    assert result["stdout"] == "xxx"
+    assert result["stderr"] == "ab"
+    assert result["truncated"] is True
+    assert result["success"]
+
+
+def test_every_result_has_the_same_keys():
+    ok = run([sys.executable, "-c", "print('hi')"])
+    timed_out = run([sys.executable, "-c", "import time; time.sleep(5)"], timeout=0.2)
+    failed = run(["/nonexistent/command"])
+
+    assert ok["truncated"] is False
+    assert timed_out.keys() == ok.keys() == failed.keys()
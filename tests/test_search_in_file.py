@@ -0,0 +1,93 @@
+import os
+import re
+import time
+from pathlib import Path
+
+import pytest
+
+import server
+
+
+@pytest.fixture(params=["cached", "mmap"])
+def read_path(request, monkeypatch):
+    """Run each test through both the cached small-file path and the memory-mapped path."""
+    if request.param == "mmap":
+        monkeypatch.setattr(server, "_MMAP_THRESHOLD", 0)
+        monkeypatch.setattr(server, "_COUNT_CHUNK_SIZE", 64)
+    return request.param
+
+
+@pytest.mark.parametrize("pattern", [r"a[^z]*z", r"a\s+z", r"a\W*z", r"(?s)a.*z"])
+def test_failing_newline_crossing_pattern_is_not_quadratic(tmp_path, pattern):
+    path = tmp_path / "config.txt"
+    path.write_text("value = a foo bar\n" * 32000)
+
+    start = time.perf_counter()
+    result = server.search_in_file(path, pattern, max_matches=-1)
+    elapsed = time.perf_counter() - start
+
+    assert result["success"]
+    assert result["match_count"] == 0
+    # Searching the rest of the file from every candidate took tens of seconds here
+    assert elapsed < 2
+
+
+@pytest.mark.parametrize("pattern", [r"a[^z]*z", r"\s", r"a\s*+(?<=\n)", r"(?>a\s*)b", r"a++\n"])
+def test_newline_crossing_patterns_match_line_by_line(tmp_path, read_path, pattern):
+    path = tmp_path / "lines.txt"
+    path.write_text("a\nz\nab\na  \nb a\nxaz\n")
+    with open(path) as f:
+        expected = [
+            {"line_number": i, "content": line.rstrip("\n")}
+            for i, line in enumerate(f, 1)
+            if re.search(pattern, line)
+        ]
+
+    result = server.search_in_file(path, pattern, max_matches=-1)
+
+    assert result["matches"] == expected
+
+
+@pytest.mark.parametrize("pattern", [r"a[^z]*z", r"\s", r"x\W", r"(?s).", r"[\t-\r]", r"a\s*+(?<=\n)", r"(?>ab)", "a$"])
+def test_patterns_that_can_leave_the_line_are_searched_per_line(pattern):
+    assert server._get_text_regex(pattern, 0) is None
+
+
+@pytest.mark.parametrize("pattern", ["TODO", r"def\w+\(", r"^a.*z", r"[^\n]+x", r"\bfoo\b"])
+def test_line_local_patterns_are_searched_across_the_text(pattern):
+    assert server._get_text_regex(pattern, 0) is not None
+
+
+@pytest.mark.parametrize("name", ["missing.txt", "file.txt/child", "loop"])
+def test_unopenable_paths_are_reported_missing(tmp_path, name):
+    (tmp_path / "file.txt").write_text("hello\n")
+    (tmp_path / "loop").symlink_to(tmp_path / "loop")
+
+    result = server.search_in_file(tmp_path / name, "hello")
+
+    assert result["success"] is False
+    assert result["error"] == f"File {tmp_path / name} does not exist"
+
+
+def test_directory_is_reported_as_search_error(tmp_path):
+    result = server.search_in_file(tmp_path, "hello")
+
+    assert result["success"] is False
+    assert result["error"].startswith("Error searching file:")
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/meminfo"), reason="needs procfs")
+def test_pseudo_file_without_size_is_searched():
+    result = server.search_in_file(Path("/proc/meminfo"), r"^MemTotal:")
+
+    assert result["match_count"] == 1
+    assert result["matches"][0]["line_number"] == 1
+
+
+def test_empty_file_has_no_matches(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_text("")
+
+    result = server.search_in_file(path, "^")
+
+    assert result == {"success": True, "matches": [], "match_count": 0, "truncated": False}
@@ -0,0 +1,61 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("name", ["missing.txt", "file.txt/child", "loop"])
+def test_unopenable_paths_are_reported_missing(tmp_path, name):
+    (tmp_path / "file.txt").write_text("hello\n")
+    (tmp_path / "loop").symlink_to(tmp_path / "loop")
+
+    result = server.show_file(tmp_path / name)
+
+    assert result["success"] is False
+    assert result["error"] == f"File {tmp_path / name} does not exist"
+
+
+def test_directory_is_reported_as_read_error(tmp_path):
+    result = server.show_file(tmp_path)
+
+    assert result["success"] is False
+    assert result["error"].startswith("Error reading file:")
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="needs procfs")
+def test_pseudo_file_without_size_is_read_to_eof():
+    with open("/proc/self/status") as f:
+        expected = f.read().splitlines()
+
+    result = server.show_file(Path("/proc/self/status"), num_lines=1)
+
+    assert result["success"]
+    assert result["content"] == expected[0]
+    assert result["total_lines"] > 1
+
+
+@pytest.mark.parametrize("mapped", [False, True])
+@pytest.mark.parametrize("raw, lines", [
+    (b"a\rb\rc\n", ["a", "b", "c"]),
+    (b"a\r\nb\r\n\r\nc", ["a", "b", "", "c"]),
+    (b"a\x0cb\nc\xe2\x80\xa8d\n", ["a\x0cb", "c\u2028d"]),
+])
+def test_tools_share_one_line_model(tmp_path, monkeypatch, mapped, raw, lines):
+    if mapped:
+        monkeypatch.setattr(server, "_MMAP_THRESHOLD", 0)
+        monkeypatch.setattr(server, "_COUNT_CHUNK_SIZE", 2)
+    path = tmp_path / "lines.txt"
+    path.write_bytes(raw)
+
+    shown = server.show_file(path)
+    found = server.search_in_file(path, "^", max_matches=-1)
+
+    assert shown["content"] == "\n".join(lines)
+    assert shown["total_lines"] == len(lines)
+    assert found["matches"] == [{"line_number": i, "content": line} for i, line in enumerate(lines, 1)]
+
+    edited = server.edit_file(path, line_operations=[{"operation": "replace", "line": len(lines), "content": "z"}])
+
+    assert edited["line_operations_performed"][0]["old_content"] == lines[-1]